@@ -1,10 +1,13 @@
+import logging
 import sqlite3
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
 from typing import Optional
 
-@dataclass
+log = logging.getLogger(__name__)
+
+@dataclass(slots=True, frozen=True)
 class PostData:
     """Structure for scraped forum post"""
     id: int
@@ -12,7 +15,8 @@ class PostData:
     title: str
     author: str
     replies: int
-    reply_timestamp: datetime
+    # Kept as the stored 'YYYY-MM-DD HH:MM:SS' string so rows compare without datetime parsing
+    reply_timestamp: str
     reply_author: str
     first_seen: Optional[datetime] = None
 
@@ -20,7 +24,7 @@ class PostData:
 class BoardStorage:
     """
     Class for storing and managing posts from a specific board in an SQLite database.
-    Handles automatic conversion of DATETIME fields.
+    DATETIME fields are read back as their stored 'YYYY-MM-DD HH:MM:SS' strings.
     """
     def __init__(self, table_name: str, db_path: str = "hackwatch.db"):
         """Initializes the storage configuration."""
@@ -28,43 +32,81 @@ class BoardStorage:
         self.table_name = table_name
         self.conn = None
         self.table_dict = None
+        # Fixed-shape INSERT and full-row UPDATE statements, built once in __enter__
+        # so every write reuses the same prepared statement
+        self._insert_sql = None
+        self._update_sql = None
+        # Only the most recently replied-to rows are preloaded into table_dict;
+        # anything older is looked up on demand by _lookup_row
+        self.preload_limit = 500
+        self._table_complete = False
+        # Writes buffered by save_or_update_row, executed in bulk by flush()
+        self._pending_inserts: list[tuple] = []
+        self._pending_updates: list[tuple] = []
+        # table_dict entries as they were before the pending writes, restored if flush() fails
+        self._pending_previous: dict[int, Optional[tuple]] = {}
         # Columns to check for updates against a PostData object
         self.columns_post = ['url', 'title', 'author', 'replies', 'reply_timestamp', 'reply_author']
+        # Connection tuning for a write-heavy scraper: WAL journal, fewer fsyncs, bigger cache
+        self.pragmas = [
+            'journal_mode=WAL',
+            'synchronous=NORMAL',
+            'temp_store=MEMORY',
+            'cache_size=-64000',
+            'mmap_size=268435456',
+        ]
 
     def __enter__(self):
         """
         Establishes the database connection as a context manager.
-        - `detect_types=sqlite3.PARSE_DECLTYPES`: Crucial for converting
-          database types (like DATETIME) to Python types (datetime.datetime).
-        - `row_factory = sqlite3.Row`: Allows accessing columns by name.
+        - No connection-wide row factory: bulk reads work on raw tuples, set
+          `_postdata_factory` on a cursor for queries that should return PostData.
+        - `isolation_level=None`: Disables implicit transactions, flush()
+          opens one explicit transaction per batch instead.
+        - `self.pragmas`: Applied right after connecting.
         """
-        self.conn = sqlite3.connect(self.db_path, detect_types=sqlite3.PARSE_DECLTYPES)
-        self.conn.row_factory = self._postdata_factory
+        self.conn = sqlite3.connect(self.db_path, isolation_level=None)
+        for pragma in self.pragmas:
+            self.conn.execute(f"PRAGMA {pragma}")
         self._init_db()
+        # first_seen falls back to the insert time; tables created before the
+        # column had a default would otherwise get NULL
+        self._insert_sql = (
+            f"""INSERT INTO {self.table_name}
+                (id, url, title, author, replies, reply_timestamp, reply_author, first_seen)
+                VALUES (?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))"""
+        )
+        self._update_sql = (
+            f"""UPDATE {self.table_name}
+                SET url = ?, title = ?, author = ?, replies = ?, reply_timestamp = ?, reply_author = ?,
+                    last_updated = CURRENT_TIMESTAMP
+                WHERE id = ?"""
+        )
         self.table_dict = self._table_to_dict()
         return self
 
     def _postdata_factory(self, cursor, row):
-        '''Custom row factoru function to keep timestamps from breaking'''
-        field_names = [col[0] for col in cursor.description]
-        row_dict = dict(zip(field_names, row))
-
-        # Only include keys that PostData accepts
-        relevant_keys = {'id', 'url', 'title', 'author', 'replies', 'reply_timestamp', 'reply_author'}
-        filtered_row = {k: v for k, v in row_dict.items() if k in relevant_keys}
-
-        # Convert timestamp from 'YYYY-MM-DD HH:MM:SS'
-        filtered_row["reply_timestamp"] = datetime.strptime(filtered_row["reply_timestamp"], "%Y-%m-%d %H:%M:%S")
-
-        return PostData(**filtered_row)
-
-
+        '''
+        Custom row factory for (id, url, title, author, replies, reply_timestamp, reply_author) queries.
+        Set per cursor (`cursor.row_factory = self._postdata_factory`) where PostData is wanted.
+        '''
+        return PostData(
+            id=row[0],
+            url=row[1],
+            title=row[2],
+            author=row[3],
+            replies=row[4],
+            reply_timestamp=row[5],
+            reply_author=row[6]
+        )
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        """Commits changes and closes the connection upon exit."""
+        """Flushes pending writes and closes the connection upon exit, even if the flush fails."""
         if self.conn:
-            self.conn.commit()
-            self.conn.close()
+            try:
+                self.flush()
+            finally:
+                self.conn.close()
 
     def _init_db(self):
         """
@@ -79,91 +121,144 @@ class BoardStorage:
             replies INTEGER DEFAULT 0,
             reply_timestamp DATETIME,
             reply_author TEXT,
-            first_seen DATETIME,
+            first_seen DATETIME DEFAULT CURRENT_TIMESTAMP,
             last_updated DATETIME DEFAULT CURRENT_TIMESTAMP,
             read_by_scan BOOLEAN DEFAULT 0
         );
         '''
         self.conn.execute(schema)
-        self.conn.commit()
+        self.conn.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_{self.table_name}_reply_ts ON {self.table_name}(reply_timestamp)"
+        )
 
     def _table_to_dict(self):
         """
-        Fetches all table contents and converts them into a dictionary
-        keyed by the primary key ('id'). Assumes a row_factory that returns
-        PostData objects.
+        Fetches the `preload_limit` most recently replied-to rows and converts them
+        into a dictionary keyed by the primary key ('id'), with values as tuples
+        ordered like `columns_post`. Reads raw rows, skipping PostData construction.
         """
         cursor = self.conn.execute(
-            f"SELECT id, url, title, author, replies, reply_timestamp, reply_author FROM {self.table_name}"
+            f"""SELECT id, url, title, author, replies, reply_timestamp, reply_author FROM {self.table_name}
+                ORDER BY reply_timestamp DESC LIMIT ?""",
+            (self.preload_limit,)
         )
 
         table_dict = {}
-        for post in cursor.fetchall():  # Each row is a PostData object now
-            pk_value = post.id
-            table_dict[pk_value] = asdict(post)
+        for row in cursor.fetchall():
+            table_dict[row[0]] = row[1:]
 
+        # Fewer rows than the limit means the whole table is in memory
+        self._table_complete = len(table_dict) < self.preload_limit
         return table_dict
-    
+
+    def _lookup_row(self, post_id: int):
+        """
+        Fetches a single row not preloaded by _table_to_dict.
+        Returns its values tuple, or None if the post is not in the table.
+        """
+        if self._table_complete:
+            return None
+        return self.conn.execute(
+            f"SELECT url, title, author, replies, reply_timestamp, reply_author FROM {self.table_name} WHERE id = ?",
+            (post_id,)
+        ).fetchone()
+
+    def _post_values(self, post: PostData) -> tuple:
+        """Values of `columns_post` for a post, as a tuple"""
+        return (post.url, post.title, post.author, post.replies, post.reply_timestamp, post.reply_author)
+
     def save_or_update_row(self, post: PostData):
         """
         Saves a new post or updates an existing one by comparing it
-        with the in-memory dictionary.
+        with the in-memory dictionary. Writes are buffered until flush() is called.
         Returns True if no update was needed (post unchanged), False if post was new or updated.
         """
-        # Using a try-except block is slightly cleaner than checking for key existence
-        try:
-            existing_post = self.table_dict[post.id]
-            # Post already exists. Check if any data is updated.
-            needs_update = False
-            update_clauses = []
-            update_values = []
-            
-            for col in self.columns_post:
-                new_value = getattr(post, col)
-                # This comparison now works correctly for all types, including datetime.
-                if new_value != existing_post[col]:
-                    needs_update = True
-                    print(f'Update needed for post "{post.title}" on column "{col}":')
-                    print(f'  - FROM: {existing_post[col]} (type: {type(existing_post[col])})')
-                    print(f'  - TO:   {new_value} (type: {type(new_value)})')
-                    update_clauses.append(f"{col} = ?")
-                    update_values.append(new_value)
-        
-            if needs_update:
-                # Also update the 'last_updated' timestamp
-                update_clauses.append("last_updated = CURRENT_TIMESTAMP")
-                update_values.append(post.id)  # For the WHERE clause
-            
-                query = f"UPDATE {self.table_name} SET {', '.join(update_clauses)} WHERE id = ?"
-                self.conn.execute(query, tuple(update_values))
-                print(f'Updated existing post: "{post.title}"')
-                
-                # Update the in-memory dictionary with new values
-                for col in self.columns_post:
-                    self.table_dict[post.id][col] = getattr(post, col)
-                
-                return False  # Post was updated
-            else:
-                print(f'No update needed for post: "{post.title}"')
-                return True  # No update was needed
-                
-        except KeyError:
-            # Data does not exist in table_dict (new post). Insert it.
-            # print(f'New post found: "{post.title}". Inserting into database.')
-            self.conn.execute(
-                f'''INSERT INTO {self.table_name}
-                    (id, url, title, author, replies, reply_timestamp, reply_author, first_seen)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-                (post.id, post.url, post.title, post.author, post.replies, post.reply_timestamp, post.reply_author, post.first_seen)
-            )
-            
-            # Add the new post to the in-memory dictionary
-            self.table_dict[post.id] = {
-                col: getattr(post, col) for col in self.columns_post
-            }
-            
-            return False  # New post was added
+        existing_post = self.table_dict.get(post.id)
+        if existing_post is None:
+            # Not preloaded, check the table itself before treating it as new
+            existing_post = self._lookup_row(post.id)
+            if existing_post is None:
+                # Data does not exist in table (new post). Insert it.
+                # print(f'New post found: "{post.title}". Inserting into database.')
+                self._pending_inserts.append(
+                    (post.id, post.url, post.title, post.author, post.replies, post.reply_timestamp, post.reply_author, post.first_seen)
+                )
+
+                # Add the new post to the in-memory dictionary
+                self._cache_values(post.id, self._post_values(post))
+
+                return False  # New post was added
+
+        # Post already exists. Fast path: one tuple comparison for an unchanged post.
+        new_values = self._post_values(post)
+        if new_values == existing_post:
+            log.debug('No update needed for post: "%s"', post.title)
+            return True  # No update was needed
+
+        # Cold path: report which columns changed, only when debug logging is on
+        if log.isEnabledFor(logging.DEBUG):
+            for col, new_value, old_value in zip(self.columns_post, new_values, existing_post):
+                if new_value != old_value:
+                    log.debug('Update needed for post "%s" on column "%s":', post.title, col)
+                    log.debug('  - FROM: %s (type: %s)', old_value, type(old_value))
+                    log.debug('  - TO:   %s (type: %s)', new_value, type(new_value))
+
+        # Queue a full-row update so every pending update shares one statement
+        self._pending_updates.append(new_values + (post.id,))
+        log.debug('Updated existing post: "%s"', post.title)
+
+        # Update the in-memory dictionary with new values
+        self._cache_values(post.id, new_values)
 
+        return False  # Post was updated
+
+    def _cache_values(self, post_id: int, values: tuple):
+        """Stores values in table_dict, remembering the previous entry until the next flush()"""
+        self._pending_previous.setdefault(post_id, self.table_dict.get(post_id))
+        self.table_dict[post_id] = values
+
+    def save_or_update_many(self, posts: list[PostData]) -> bool:
+        """
+        Queues a batch of posts and writes them in one go.
+        Stops at the first unchanged post, mirroring save_or_update_row.
+        Returns True if an unchanged post was found, False otherwise.
+        """
+        found_unchanged = False
+        for post in posts:
+            if self.save_or_update_row(post):
+                found_unchanged = True
+                break
+        self.flush()
+        return found_unchanged
+
+    def flush(self):
+        """
+        Executes all buffered inserts and updates with one executemany call each,
+        inside a single transaction. On error, rolls back and restores table_dict
+        so it only describes rows that were actually written.
+        """
+        if not (self._pending_inserts or self._pending_updates):
+            return
+        try:
+            self.conn.execute("BEGIN IMMEDIATE")
+            if self._pending_inserts:
+                self.conn.executemany(self._insert_sql, self._pending_inserts)
+            if self._pending_updates:
+                self.conn.executemany(self._update_sql, self._pending_updates)
+            self.conn.execute("COMMIT")
+        except Exception:
+            if self.conn.in_transaction:
+                self.conn.execute("ROLLBACK")
+            for post_id, previous in self._pending_previous.items():
+                if previous is None:
+                    self.table_dict.pop(post_id, None)
+                else:
+                    self.table_dict[post_id] = previous
+            raise
+        finally:
+            self._pending_inserts.clear()
+            self._pending_updates.clear()
+            self._pending_previous.clear()
 
     def try_sqlite_stuff(self, post: PostData):
         '''test function'''
@@ -2,34 +2,110 @@
 
 from typing import List, Optional
 import asyncio
-from urllib.parse import urlparse, parse_qs, urlencode
-from datetime import datetime
+import logging
+import re
 import aiohttp
-from bs4 import BeautifulSoup
+from lxml import etree
+from lxml import html as lhtml
 
 from data_object import PostData, BoardStorage
 from utils import boards
 
+log = logging.getLogger(__name__)
+
+# Topic links look like ...index.php?topic=123456.0, only the integer id is kept
+_TOPIC_RE = re.compile(r'topic=(\d+)')
+_CLEAN_PREFIX = "https://geekhack.org/index.php?topic="
+
+
+def _cls(name: str) -> str:
+    '''XPath test for one token of the class attribute'''
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+# XPaths compiled once; cell lookups cover the normal and locked variants
+_POST_ROWS_XP = etree.XPath(f"(//table[{_cls('table_grid')}])[1]//tr[not(@class)]")
+_PAGENAV_XP = etree.XPath(f"//div[{_cls('pagelinks')} and {_cls('floatleft')}]")
+_SUBJECT_XP = etree.XPath(f".//td[{_cls('subject')} and ({_cls('windowbg2')} or {_cls('lockedbg2')})]")
+_STATS_XP = etree.XPath(f".//td[{_cls('stats')} and ({_cls('windowbg')} or {_cls('lockedbg')})]")
+_LASTPOST_XP = etree.XPath(f".//td[{_cls('lastpost')} and ({_cls('windowbg2')} or {_cls('lockedbg2')})]")
+_PINNED_XP = etree.XPath(f".//td[{_cls('subject')} and {_cls('stickybg2')}]")
+_TITLE_SPAN_XP = etree.XPath(".//span")
+_AUTHOR_P_XP = etree.XPath(".//p")
+_LINK_XP = etree.XPath(".//a[@href]")
+
+# Month names as they appear in GH timestamps, avoids locale-aware strptime
+_MONTHS = {
+    'January': '01', 'February': '02', 'March': '03', 'April': '04', 'May': '05', 'June': '06',
+    'July': '07', 'August': '08', 'September': '09', 'October': '10', 'November': '11', 'December': '12'
+}
+
+
+def create_session() -> aiohttp.ClientSession:
+    '''HTTP session shared by every board, so connections, DNS and TLS are set up once'''
+    return aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=30),
+        headers={
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+        }
+    )
+
+
+class RequestLimiter:
+    '''
+    Politeness limits for one host: pages in flight at once, and seconds between request starts.
+    Share one instance between every scraper that talks to the same host.
+    '''
+
+    def __init__(self, max_concurrency: int = 6, min_request_interval: float = 1.0):
+        self.max_concurrency = max_concurrency
+        self.min_request_interval = min_request_interval
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._rate_lock = asyncio.Lock()
+        self._last_request = 0.0
+
+    async def __aenter__(self):
+        await self._semaphore.acquire()
+        try:
+            await self._wait_for_rate_limit()
+        except BaseException:
+            self._semaphore.release()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._semaphore.release()
+
+    async def _wait_for_rate_limit(self):
+        '''Pvt: Space out request starts by at least min_request_interval seconds'''
+        loop = asyncio.get_running_loop()
+        async with self._rate_lock:
+            wait = self._last_request + self.min_request_interval - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._last_request = loop.time()
+
 
 class HackWatch:
     '''Scraping object for one Geekhack board at a time'''
 
-    def __init__(self, board: int):
+    def __init__(self, board: int, session: Optional[aiohttp.ClientSession] = None,
+                 limiter: Optional[RequestLimiter] = None):
         self.url = "https://geekhack.org/index.php?board="
         self.board = board
-        self.session = None
+        # A session passed in is owned by the caller and left open on exit
+        self.session = session
+        self._owns_session = session is None
+        # Pass the same limiter to every board so the limits apply per host, not per board
+        self.limiter = limiter or RequestLimiter()
 
     async def __aenter__(self):
-        self.session = aiohttp.ClientSession(
-            timeout=aiohttp.ClientTimeout(total=30),
-            headers={
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            }
-        )
+        if self._owns_session:
+            self.session = create_session()
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        if self.session:
+        if self.session and self._owns_session:
             await self.session.close()
 
     async def scrape_page_text(self, page_url: str) -> List[PostData]:
@@ -38,8 +114,14 @@ class HackWatch:
         if not page_text:
             return []
 
-        soup = BeautifulSoup(page_text, 'html.parser')
-        post_rows = self._extract_post_rows(soup)
+        # Parsing is CPU-bound, run it off the event loop so other fetches keep going
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._parse_page, page_text)
+
+    def _parse_page(self, page_text: str) -> List[PostData]:
+        '''Pvt: Parse one page of HTML into PostData objects'''
+        tree = lhtml.fromstring(page_text)
+        post_rows = self._extract_post_rows(tree)
 
         posts = []
         for row in post_rows:
@@ -58,11 +140,10 @@ class HackWatch:
         if not page_text:
             return
 
-        soup = BeautifulSoup(page_text, 'html.parser')
+        tree = lhtml.fromstring(page_text)
 
-        pagenav = soup.find('div', class_='pagelinks floatleft')
-        # pageList = [p.get_text(strip=True) for p in pagenav]
-        pagenav_string = str(pagenav.text.strip())
+        pagenav = _PAGENAV_XP(tree)[0]
+        pagenav_string = pagenav.text_content().strip()
         pagenav_split = pagenav_string.split()
         pgno_index = pagenav_split.index("»")
         # print(int(pagenav_split[pgno_index-1])*50)
@@ -72,23 +153,21 @@ class HackWatch:
 
 
     async def _get_page_content(self, url: str):
-        '''Pvt: Fetch response of one page'''
-        try:
-            async with self.session.get(url) as response:
-                if response.status == 200:
-                    return await response.text()
-                print(f"Status {response.status} returned")
+        '''Pvt: Fetch response of one page, within the concurrency and rate limits'''
+        async with self.limiter:
+            try:
+                async with self.session.get(url) as response:
+                    if response.status == 200:
+                        return await response.text()
+                    print(f"Status {response.status} returned")
+                    return None
+            except Exception as e:
+                print(f"Error fetching {url} - {e}")
                 return None
-        except Exception as e:
-            print(f"Error fetching {url} - {e}")
-            return None
 
-    def _extract_post_rows(self, soup: BeautifulSoup) -> List:
+    def _extract_post_rows(self, tree: lhtml.HtmlElement) -> List[lhtml.HtmlElement]:
         '''Pvt: Extract all post rows from an extracted page'''
-        table = soup.find('table', class_='table_grid')
-        if not table:
-            return []
-        return table.find_all('tr', class_=None)
+        return _POST_ROWS_XP(tree)
 
     def _build_postdata(self, row) -> Optional[PostData]:
         '''
@@ -96,13 +175,16 @@ class HackWatch:
         Split into many helper methods for readability
         All helper methods start with "parse" for readability
         '''
-        subject_cell = row
-        # print(subject_cell)
         try:
+            # Find each cell once, helpers only look inside their own cell
+            subject_cell = _SUBJECT_XP(row)[0]
+            stats_cell = _STATS_XP(row)[0]
+            lastpost_cell = _LASTPOST_XP(row)[0]
+
             # Extract all components
             title, author, post_id, url = self._parse_title_author_id_url(subject_cell)
-            replies = self._parse_replies(row)
-            reply_timestamp, reply_author, first_seen = self._parse_reply_time_and_author(row)
+            replies = self._parse_replies(stats_cell)
+            reply_timestamp, reply_author = self._parse_reply_time_and_author(lastpost_cell)
 
             return PostData(
                 id=post_id,
@@ -111,56 +193,46 @@ class HackWatch:
                 author=author,
                 replies=replies,
                 reply_timestamp=reply_timestamp,
-                reply_author=reply_author,
-                first_seen=first_seen
+                reply_author=reply_author
             )
         except Exception as e:
             # Log error but don't crash entire scrape
-            if subject_cell.find('td', class_='subject stickybg2'):
+            if _PINNED_XP(row):
                 print("Ignoring pinned post")
                 return None
             print(f"Error parsing row: {e}")
             return None
 
-    def _parse_title_author_id_url(self, subject_cell) -> tuple[str, str]:
+    def _parse_title_author_id_url(self, title_cell) -> tuple[str, str]:
         '''Extract title and author from subject cell'''
-        title_cell = subject_cell.find('td', class_='subject windowbg2') or subject_cell.find('td', class_='subject lockedbg2')
+        title_span = _TITLE_SPAN_XP(title_cell)[0]
+        title = title_span.text_content().strip()
 
-        title_span = title_cell.find('span')
-        title = title_span.text.strip()
-
-        author_p = title_cell.find('p')
-        author_string = author_p.text.splitlines()[0]
+        author_p = _AUTHOR_P_XP(title_cell)[0]
+        author_string = author_p.text_content().splitlines()[0]
         by_index = author_string.find('by') + 2
         author = author_string[by_index:].strip()
 
-        link = title_cell.find('span').find('a', href=True)
-        url_full = link['href']
-
-        # Parse and clean URL
-        parsed = urlparse(url_full)
-        params = parse_qs(parsed.query)
-        topic_id = int(float(params['topic'][0]))
+        link = _LINK_XP(title_span)[0]
+        url_full = link.get('href')
 
         # Build clean URL with only topic parameter
-        clean_params = {'topic': topic_id}
-        clean_url = f"{parsed.scheme}://{parsed.netloc}{parsed.path}?{urlencode(clean_params)}"
+        topic_id = int(_TOPIC_RE.search(url_full).group(1))
+        clean_url = f"{_CLEAN_PREFIX}{topic_id}"
 
         return title, author, topic_id, clean_url
 
-    def _parse_replies(self, row) -> tuple[int, int]:
+    def _parse_replies(self, stats_cell) -> tuple[int, int]:
         '''Extract reply count and view count from stats cell'''
-        stats_cell = row.find('td', class_='stats windowbg') or row.find('td', class_='stats lockedbg')
-        stats_text = stats_cell.text.strip().lower()
+        stats_text = stats_cell.text_content().strip().lower()
         replies_end = stats_text.find('replies')
         replies = int(stats_text[:replies_end].strip())
 
         return replies
 
-    def _parse_reply_time_and_author(self, row) -> tuple[datetime, str]:
-        '''Extract last post timestamp and author'''
-        lastpost_cell = row.find('td', class_='lastpost windowbg2') or row.find('td', class_='lastpost lockedbg2')
-        lastpost_text = lastpost_cell.text.strip()
+    def _parse_reply_time_and_author(self, lastpost_cell) -> tuple[str, str]:
+        '''Extract last post timestamp and author from lastpost cell'''
+        lastpost_text = lastpost_cell.text_content().strip()
 
         # Split on 'by' to separate timestamp and author
         by_index = lastpost_text.find('by')
@@ -169,18 +241,24 @@ class HackWatch:
 
         reply_timestamp = self._util_convert_timestamp(timestamp_str)
 
-        first_seen = datetime.now()
+        return reply_timestamp, reply_author
 
-        return reply_timestamp, reply_author, first_seen
-
-    def _util_convert_timestamp(self, timestamp_string: str):
-        '''Internal method to convert GH table timestamp'''
-        return datetime.strptime(timestamp_string, "%a, %d %B %Y, %H:%M:%S")
+    def _util_convert_timestamp(self, timestamp_string: str) -> str:
+        '''
+        Internal method to convert GH table timestamp, e.g. "Mon, 05 August 2024, 13:42:11",
+        into the "2024-08-05 13:42:11" string SQLite stores, without building a datetime
+        '''
+        _, day, month, rest = timestamp_string.split(' ', 3)
+        year, hms = rest.split(', ')
+        hour, minute, second = hms.split(':')
+        return f"{int(year):04d}-{_MONTHS[month]}-{int(day):02d} {int(hour):02d}:{int(minute):02d}:{int(second):02d}"
 
 
-async def try_func(board_name: str, board_data: tuple[int, str]):
+async def try_func(board_name: str, board_data: tuple[int, str],
+                   session: Optional[aiohttp.ClientSession] = None,
+                   limiter: Optional[RequestLimiter] = None):
     '''test'''
-    async with HackWatch(board_data[0]) as scraper:
+    async with HackWatch(board_data[0], session=session, limiter=limiter) as scraper:
         base_url = scraper.url + str(scraper.board)
 
         print("For Board", board_name)
@@ -189,47 +267,68 @@ async def try_func(board_name: str, board_data: tuple[int, str]):
 
         with BoardStorage(table_name=board_data[1]) as post_saver:
 
-            # Process pages sequentially from 0 to 3000 in increments of 50
-            for post_num in range(0, pagecounts, 50):
-                # Add delay between requests (except for the first one)
-                if post_num > 0:
-                    print("Waiting 3 seconds before next request...")
-                    await asyncio.sleep(3)
+            # Page offsets run from 0 in increments of 50, first page has no suffix
+            page_nums = list(range(0, pagecounts, 50))
+            page_urls = [base_url if post_num == 0 else f"{base_url}.{post_num}" for post_num in page_nums]
 
-                # Construct the URL for this page
-                if post_num == 0:
-                    current_url = base_url  # First page has no suffix
-                else:
-                    current_url = f"{base_url}.{post_num}"
+            # Page fetches run as tasks but are written in page order, so the database
+            # sees one writer and the early exit still works. Page 0 is fetched alone since
+            # most runs stop there; after that up to max_concurrency pages are kept in flight.
+            max_concurrency = scraper.limiter.max_concurrency
+            tasks = {}
+            try:
+                for index, (post_num, current_url) in enumerate(zip(page_nums, page_urls)):
+                    lookahead = max_concurrency if index > 0 else 1
+                    for ahead in range(index, min(index + lookahead, len(page_urls))):
+                        if ahead not in tasks:
+                            tasks[ahead] = asyncio.create_task(scraper.scrape_page_text(page_urls[ahead]))
 
-                print(f"\n--- Processing posts from: {current_url} ---")
+                    log.info("[%s] --- Processing posts from: %s ---", board_name, current_url)
 
-                try:
-                    posts = await scraper.scrape_page_text(current_url)
+                    try:
+                        posts = await tasks.pop(index)
 
-                    if not posts:
-                        print(f"No posts found on page {post_num}. Continuing to next page.")
-                        continue
+                        if not posts:
+                            print(f"[{board_name}] No posts found on page {post_num}. Continuing to next page.")
+                            continue
 
-                    print(f"Found {len(posts)} posts on page {post_num}")
+                        log.info("[%s] Found %d posts on page %d", board_name, len(posts), post_num)
 
-                    # Process posts sequentially for this page
-                    for post in posts:
-                        no_update_needed = post_saver.save_or_update_row(post)
-                        # print(f"Status for post '{post.title}': {'No update needed' if no_update_needed else 'Updated/Added'}")
+                        # Write the whole page in one batch, stopping at the first unchanged post
+                        no_update_needed = post_saver.save_or_update_many(posts)
 
                         if no_update_needed:
-                            print(f"Row was not updated/added. Nothing new to update. Exiting at page {post_num}")
+                            print(f"[{board_name}] Row was not updated/added. Nothing new to update. Exiting at page {post_num}")
                             return
-                except Exception as e:
-                    print(f"Error processing page {post_num}: {e}")
-                    # Continue to next page even if current page fails
-                    continue
+                    except Exception as e:
+                        print(f"[{board_name}] Error processing page {post_num}: {e}")
+                        # Continue to next page even if current page fails
+                        continue
+            finally:
+                # Don't keep fetching pages that will never be written
+                for task in tasks.values():
+                    task.cancel()
+                await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+            print(f"[{board_name}] All pages processed - reached the end without finding unchanged posts")
+
+
+async def main(max_boards: int = 3):
+    '''
+    Scrape every board on one event loop and one session, a few boards at a time.
+    All boards share one RequestLimiter, so geekhack.org sees the same limits however many run.
+    '''
+    board_limit = asyncio.Semaphore(max_boards)
+    limiter = RequestLimiter()
 
-            print("All pages processed - reached the end without finding unchanged posts")
+    async def bounded(name: str, data: tuple[int, str], session: aiohttp.ClientSession):
+        async with board_limit:
+            await try_func(name, data, session, limiter)
 
+    async with create_session() as session:
+        await asyncio.gather(*(bounded(name, data, session) for name, data in boards.items()))
 
 
 if __name__ == "__main__":
-    for name, data in boards.items():
-        asyncio.run(try_func(name, data))
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    asyncio.run(main())
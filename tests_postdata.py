@@ -7,7 +7,7 @@ test_post_add_new_row = PostData(
     title="Test Posting",
     author="tester",
     replies=123456,
-    reply_timestamp=datetime(year=2022, month=1, day=1, hour=0, minute=0, second=0),
+    reply_timestamp="2022-01-01 00:00:00",
     reply_author="also_tester",
     first_seen=datetime(year=2022, month=1, day=1, hour=0, minute=0, second=0)
 )
\ No newline at end of file